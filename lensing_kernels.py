@@ -0,0 +1,47 @@
+# 미세중력렌즈 광도 계산 커널 (numba JIT 컴파일)
+# main.py 와 분리해 두어 Streamlit 재실행마다 커널을 다시 정의/로드하지 않도록 합니다.
+import math
+
+import numpy as np
+from numba import float64, njit, vectorize
+
+@vectorize([float64(float64)], fastmath=True, cache=True)
+def paczynski(u):
+    # Micro-lensing magnification formula (point-source point-lens)
+    # 배열에 그대로 적용할 수 있는 네이티브 ufunc 로 컴파일됩니다.
+    u2 = u * u
+    return (u2 + 2.0) / (u * math.sqrt(u2 + 4.0))
+
+@njit(cache=True, fastmath=True)
+def _impact_kernel(planet_pos, observer_pos, los_unit, einstein_r):
+    # 한 프레임(행성 위치 1개)에 대한 impact parameter u 를 계산하는 스칼라 커널입니다.
+    # 2-벡터는 np.array 로 감싸지 않고 (x, y) 튜플을 풀어 스칼라 산술과 math 함수로 계산합니다.
+    px, py = planet_pos
+    ox, oy = observer_pos
+    ux, uy = los_unit
+
+    # Vector from observer to planet
+    vec_op_x = px - ox
+    vec_op_y = py - oy
+
+    # Dot product to find the component along the line of sight
+    proj_length = vec_op_x * ux + vec_op_y * uy
+
+    # 행성의 위치에서 관찰자->중심별 시선까지의 수직 거리 (아인슈타인 반경의 'u'에 해당)
+    # u가 0에 가까울수록 증폭이 커집니다.
+    perpendicular_dist = math.hypot(vec_op_x - proj_length * ux, vec_op_y - proj_length * uy)
+
+    return perpendicular_dist / einstein_r
+
+@njit(cache=True)
+def impact_kernel_batch(planet_x, planet_y, observer_pos, los_unit, einstein_r):
+    # 전체 시간 격자에 대해 _impact_kernel 을 적용합니다.
+    # 프레임 수(최대 500)가 작아 멀티스레드(parallel=True) 는 스레드 비용이 더 크므로 단일 루프로 계산합니다.
+    u = np.empty(planet_x.shape[0])
+    for i in range(planet_x.shape[0]):
+        u[i] = _impact_kernel((planet_x[i], planet_y[i]), observer_pos, los_unit, einstein_r)
+    return u
+
+# 첫 컴파일은 수십 초가 걸릴 수 있으므로 임포트 시점에 한 번 호출해 캐시를 채워 둡니다.
+# Streamlit 은 main.py 를 재실행할 때마다 다시 실행하지만, 이 모듈은 프로세스당 한 번만 임포트됩니다.
+impact_kernel_batch(np.zeros(1), np.zeros(1), (0.0, 1.0), (0.0, -1.0), 1.0)
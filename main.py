@@ -3,6 +3,8 @@ import numpy as np
 import plotly.graph_objects as go
 from plotly.subplots import make_subplots
 
+from lensing_kernels import impact_kernel_batch, paczynski
+
 st.set_page_config(layout="wide")
 
 st.title("미세중력렌즈 시뮬레이션")
@@ -21,124 +23,91 @@ R_ORBIT = 5.0  # 행성 궤도 반지름 (단위)
 R_OBSERVER_DIST = 10.0 # 관찰자의 중심별로부터의 거리 (시각화용)
 
 # --- 미세중력렌즈 광도 계산 함수 (더 정교하게 구현 필요) ---
-def calculate_magnification(planet_pos, observer_pos, star_pos, planet_mass_ratio):
+def calculate_base_magnification(planet_xy, observer_pos, los_unit):
     # 이 함수는 미세중력렌즈의 배율(magnification) 공식을 적용해야 합니다.
     # 여기서는 매우 단순화된 근사를 사용합니다.
     # 실제 microlensing은 광원(source star), 렌즈(lens object, 행성), 관찰자(observer)의 정렬에 따라 결정됩니다.
     # A = (u^2 + 2) / (u * sqrt(u^2 + 4)) where u = impact parameter / Einstein radius
 
-    # 여기서는 중심별(star_pos)이 '광원'이고 행성(planet_pos)이 '렌즈' 역할을 하며,
+    # 여기서는 원점 (0,0)의 중심별이 '광원'이고 행성(planet_xy)이 '렌즈' 역할을 하며,
     # 관찰자(observer_pos)가 이 효과를 보는 상황을 시뮬레이션합니다.
+    # planet_xy 는 전체 시간 격자에 대한 (N,) 배열 (planet_x, planet_y) 쌍입니다.
+    # los_unit 은 관찰자 -> 중심별 시선 단위 벡터로, 프레임과 무관하므로 호출하는 쪽에서 한 번만 계산합니다.
+
+    # 질량비와 무관한 기하학적 부분만 계산해 (기본 배율 A(u), 정렬 여부) 배열을 반환합니다.
+    # 질량비 적용은 calculate_magnification 에서 따로 합니다.
+
+    px = np.ascontiguousarray(planet_xy[0], dtype=np.float64)
+    py = np.ascontiguousarray(planet_xy[1], dtype=np.float64)
+    ox, oy = observer_pos
+    ux, uy = los_unit
+
+    # Normalize by an "Einstein radius" proxy for visualization
+    # The Einstein radius (theta_E) depends on masses and distances.
+    # Here, let's use a constant related to the orbital radius for normalization.
+    einstein_radius_proxy = R_ORBIT * 0.1 # Example proxy, adjust for visual effect
+
+    u = impact_kernel_batch(px, py, (float(ox), float(oy)), (float(ux), float(uy)), einstein_radius_proxy)
+
+    # 행성이 중심별에 가까이 있을 때만 렌즈 효과 고려 (임계값 비교이므로 제곱 거리로 sqrt 생략)
+    in_lens_range = px * px + py * py < (R_ORBIT * 1.5) ** 2
+
+    # u <= 0.001 인 경우는 0으로 나누지 않도록 별도 값(매우 가까운 정렬 시 최대 배율)을 사용합니다.
+    base_magnification = np.where(in_lens_range, paczynski(np.maximum(u, 0.001)), 1.0)
+    aligned = in_lens_range & (u <= 0.001)
 
-    # 1. 관찰자 시점에서 행성-중심별의 상대적 위치 (선형 근사)
-    # 관찰자-중심별 벡터
-    obs_to_star_vec = -np.array(observer_pos) # (0,0) - observer_pos
-    # 관찰자-행성 벡터
-    obs_to_planet_vec = np.array(planet_pos) - np.array(observer_pos)
-
-    # 중심별을 기준으로 한 행성의 상대적 위치 (관찰자 시선에 수직한 거리)
-    # 즉, 관찰자-중심별 라인에 대한 행성의 수직 거리
-    # 투영된 거리: d_perp = |obs_to_planet_vec X obs_to_star_vec_unit|
-    
-    # 단순화를 위해, 관찰자 시점에서 행성과 중심별이 얼마나 정렬되어 있는지를 봅니다.
-    # 중심별과 행성 사이의 거리가 너무 멀면 렌즈 효과는 무시합니다.
-    
-    magnification = 1.0 # 기본 광도 (증폭 없음)
-
-    # 행성이 중심별에 가까이 있을 때만 렌즈 효과 고려
-    if np.linalg.norm(np.array(planet_pos)) < R_ORBIT * 1.5: # 행성이 궤도 근처에 있을 때
-        
-        # 중심별과 행성 사이의 거리
-        dist_star_planet = np.linalg.norm(np.array(planet_pos) - np.array(star_pos))
-        
-        # 관찰자, 행성, 중심별의 정렬을 시뮬레이션
-        # 관찰자 -> 중심별 시선 벡터
-        line_of_sight_vec = np.array(star_pos) - np.array(observer_pos)
-        line_of_sight_unit = line_of_sight_vec / np.linalg.norm(line_of_sight_vec)
-
-        # 행성의 위치에서 관찰자->중심별 시선까지의 수직 거리 (아인슈타인 반경의 'u'에 해당)
-        # 이 부분이 microlensing의 impact parameter (u)와 관련됩니다.
-        # u가 0에 가까울수록 증폭이 커집니다.
-        # 여기서는 단순히 행성에서 시선까지의 거리를 사용합니다.
-        
-        # 행성 위치 (x_p, y_p), 시선 위의 점 (x_s, y_s) (예: 중심별), 시선 벡터 (dx, dy)
-        # 점과 직선 사이의 거리 공식 응용
-        # line_of_sight_vec = (star_pos[0]-observer_pos[0], star_pos[1]-observer_pos[1])
-        # A = observer_pos[1] - star_pos[1]  (dy)
-        # B = star_pos[0] - observer_pos[0]  (-dx)
-        # C = -A*observer_pos[0] - B*observer_pos[1]
-        
-        # distance = |A*planet_pos[0] + B*planet_pos[1] + C| / sqrt(A^2 + B^2)
-
-        # Simplified u: distance from planet to observer's line of sight to star
-        # We need a point on the line of sight (e.g., star_pos) and direction vector (line_of_sight_vec)
-        # Project planet_pos onto line_of_sight_vec and find the perpendicular distance
-        
-        # Vector from observer to planet
-        vec_op = np.array(planet_pos) - np.array(observer_pos)
-        
-        # Dot product to find the component along the line of sight
-        proj_length = np.dot(vec_op, line_of_sight_unit)
-        
-        # Point on the line of sight closest to the planet
-        closest_point_on_los = np.array(observer_pos) + proj_length * line_of_sight_unit
-        
-        # Perpendicular distance from planet to line of sight
-        perpendicular_dist = np.linalg.norm(np.array(planet_pos) - closest_point_on_los)
-        
-        # Normalize by an "Einstein radius" proxy for visualization
-        # The Einstein radius (theta_E) depends on masses and distances.
-        # Here, let's use a constant related to the orbital radius for normalization.
-        einstein_radius_proxy = R_ORBIT * 0.1 # Example proxy, adjust for visual effect
-
-        u = perpendicular_dist / einstein_radius_proxy
-        
-        # Micro-lensing magnification formula (point-source point-lens)
-        if u <= 0.001: # Avoid division by zero and handle very close alignment
-            magnification = 1.0 + planet_mass_ratio * 1000 # Max magnification for very close alignment
-        else:
-            magnification = (u**2 + 2) / (u * np.sqrt(u**2 + 4))
-            # Scale by planet mass ratio to make it more pronounced for larger planets
-            magnification = 1.0 + (magnification - 1.0) * (planet_mass_ratio / 0.01) # Normalize to 0.01 mass ratio for scaling
-
-    return max(1.0, magnification) # 광도는 1.0 미만이 될 수 없음
+    return base_magnification, aligned
+
+def calculate_magnification(base_magnification, aligned, planet_mass_ratio):
+    # calculate_base_magnification 의 결과에 질량비를 적용해 프레임별 배율 배열을 반환합니다.
+    # Scale by planet mass ratio to make it more pronounced for larger planets
+    magnification = 1.0 + (base_magnification - 1.0) * (planet_mass_ratio / 0.01) # Normalize to 0.01 mass ratio for scaling
+    magnification = np.where(aligned, 1.0 + planet_mass_ratio * 1000, magnification) # Max magnification for very close alignment
+
+    return np.maximum(1.0, magnification) # 광도는 1.0 미만이 될 수 없음
 
 # --- 데이터 준비 ---
-frames_data = []
-lightcurve_values = []
-times = np.arange(orbital_period)
-
-# 관찰자 위치 계산 (고정)
-observer_angle_rad = np.radians(observer_angle_deg)
-observer_x = R_OBSERVER_DIST * np.cos(observer_angle_rad)
-observer_y = R_OBSERVER_DIST * np.sin(observer_angle_rad)
-observer_pos = (observer_x, observer_y)
 star_pos = (0, 0) # 중심별은 항상 (0,0)에 고정
 
-for t in times:
-    # 행성 위치 계산 (원형 궤도)
-    angle = 2 * np.pi * t / orbital_period
-    planet_x = R_ORBIT * np.cos(angle)
-    planet_y = R_ORBIT * np.sin(angle)
+@st.cache_data
+def build_geometry(orbital_period, observer_angle_deg):
+    # 궤도와 관찰자 배치에만 의존하는 부분입니다. 질량비만 바뀐 재실행에서는 캐시된 결과를 재사용합니다.
+    times = np.arange(orbital_period)
+
+    # 관찰자 위치 계산 (고정)
+    observer_angle_rad = np.radians(observer_angle_deg)
+    observer_x = R_OBSERVER_DIST * np.cos(observer_angle_rad)
+    observer_y = R_OBSERVER_DIST * np.sin(observer_angle_rad)
+    observer_pos = (observer_x, observer_y)
+
+    # 관찰자 -> 중심별 시선 단위 벡터 (고정)
+    los = np.array([-observer_x, -observer_y])
+    los_unit = los / np.hypot(*los)
+
+    # 행성 위치 계산 (원형 궤도) - 전체 시간 격자에 대해 한 번에 계산
+    angles = 2 * np.pi * times / orbital_period
+    planet_x = R_ORBIT * np.cos(angles)
+    planet_y = R_ORBIT * np.sin(angles)
+
+    base_magnification, aligned = calculate_base_magnification((planet_x, planet_y), observer_pos, los_unit)
+
+    return planet_x, planet_y, base_magnification, aligned, times, observer_pos
+
+@st.cache_data
+def build_simulation(orbital_period, planet_mass_ratio, observer_angle_deg):
+    # 슬라이더 값이 바뀌지 않은 재실행(버튼 클릭 등)에서는 캐시된 시뮬레이션 데이터를 그대로 사용합니다.
+    # 프레임별 상태는 planet_x, planet_y, lightcurve_values 각각의 연속된 float32 배열(SoA)로 보관합니다.
+    planet_x, planet_y, base_magnification, aligned, times, observer_pos = build_geometry(orbital_period, observer_angle_deg)
 
     # 광도 계산
-    current_magnification = calculate_magnification(
-        (planet_x, planet_y), observer_pos, star_pos, planet_mass_ratio
-    )
-    lightcurve_values.append(current_magnification)
+    lightcurve_values = calculate_magnification(base_magnification, aligned, planet_mass_ratio)
 
-    # 각 프레임에 대한 데이터 저장
-    frames_data.append({
-        'data': [
-            # Trace 0: 중심별 (고정) - 데이터 변경 없음
-            go.Scatter(x=[star_pos[0]], y=[star_pos[1]], mode='markers', marker=dict(size=20, color='gold')),
-            # Trace 1: 행성 (움직임)
-            go.Scatter(x=[planet_x], y=[planet_y], mode='markers', marker=dict(size=8, color='blue')),
-            # Trace 2: 광도 그래프 (업데이트)
-            go.Scatter(x=times[:t+1], y=lightcurve_values[:t+1], mode='lines', line=dict(color='green'))
-        ],
-        'name': f'frame_{t}'
-    })
+    # 계산은 float64 로 하고, 화면 표시용 데이터는 float32 로 저장해 직렬화되는 바이트 수를 줄입니다.
+    # (그래프 해상도에서는 정밀도 차이가 보이지 않습니다.)
+    return planet_x.astype(np.float32), planet_y.astype(np.float32), lightcurve_values.astype(np.float32), times, observer_pos
+
+planet_x, planet_y, lightcurve_values, times, observer_pos = build_simulation(orbital_period, planet_mass_ratio, observer_angle_deg)
+observer_x, observer_y = observer_pos
 
 # --- 초기 그래프 생성 ---
 fig = make_subplots(rows=1, cols=2,
@@ -151,11 +120,11 @@ fig.add_trace(go.Scatter(x=[star_pos[0]], y=[star_pos[1]], mode='markers',
                          marker=dict(size=20, color='gold'),
                          name='중심별'), row=1, col=1)
 # Trace 1: 행성 (초기 위치)
-fig.add_trace(go.Scatter(x=[R_ORBIT * np.cos(0)], y=[R_ORBIT * np.sin(0)], mode='markers',
+fig.add_trace(go.Scatter(x=[planet_x[0]], y=[planet_y[0]], mode='markers',
                          marker=dict(size=8, color='blue'),
                          name='행성'), row=1, col=1)
 
-# 관찰자 위치와 시선 추가 (고정된 선)
+# Trace 2, 3: 관찰자 위치와 시선 추가 (고정된 선)
 fig.add_trace(go.Scatter(x=[observer_x], y=[observer_y], mode='markers',
                          marker=dict(size=10, color='purple', symbol='star'),
                          name='관찰자'), row=1, col=1) # 관찰자 위치
@@ -165,24 +134,39 @@ fig.add_trace(go.Scatter(x=[observer_x, star_pos[0]], y=[observer_y, star_pos[1]
 
 fig.update_xaxes(range=[-R_ORBIT * 1.2, R_ORBIT * 1.2], row=1, col=1)
 fig.update_yaxes(range=[-R_ORBIT * 1.2, R_ORBIT * 1.2], scaleanchor="x", scaleratio=1, row=1, col=1)
-fig.update_layout(showlegend=True, legend=dict(x=0.01, y=0.99)) # 범례 추가 및 위치 조정
+# 범례 추가 및 위치 조정, uirevision 고정으로 재실행 시에도 확대/이동 상태 유지
+fig.update_layout(showlegend=True, legend=dict(x=0.01, y=0.99), uirevision='const')
 
 # 2. 광도 변화 서브플롯 (오른쪽)
-# Trace 2: 광도 그래프 (초기 데이터)
+# Trace 4: 광도 그래프 (초기 데이터)
 fig.add_trace(go.Scatter(x=[0], y=[lightcurve_values[0]], mode='lines',
                          line=dict(color='green'),
                          name='광도'), row=1, col=2)
 
 fig.update_xaxes(range=[0, orbital_period], title_text="시간 (프레임)", row=1, col=2)
 # 광도 Y축 범위 조정: 초기값부터 최대 예상값까지
-fig.update_yaxes(range=[min(0.9, min(lightcurve_values) - 0.05), max(1.5, max(lightcurve_values) + 0.05)],
+fig.update_yaxes(range=[min(0.9, lightcurve_values.min() - 0.05), max(1.5, lightcurve_values.max() + 0.05)],
                  title_text="상대 광도", row=1, col=2)
 
 # --- 애니메이션 설정 ---
-# frames 리스트에 프레임 데이터 추가
-fig.frames = [go.Frame(data=frame['data'], name=frame['name']) for frame in frames_data]
+# SoA 배열에서 프레임 데이터 생성 (ndarray 슬라이스를 그대로 넘겨 Python 리스트로 변환·복사하지 않음)
+# 고정된 중심별/관찰자 trace 는 프레임에 포함하지 않고, traces 로 움직이는 trace 만 갱신합니다.
+fig.frames = tuple(
+    go.Frame(
+        data=[
+            # Trace 1: 행성 (움직임)
+            go.Scatter(x=planet_x[t:t+1], y=planet_y[t:t+1], mode='markers', marker=dict(size=8, color='blue')),
+            # Trace 4: 광도 그래프 (업데이트)
+            go.Scatter(x=times[:t+1], y=lightcurve_values[:t+1], mode='lines', line=dict(color='green'))
+        ],
+        traces=[1, 4],
+        name=f'frame_{t}'
+    )
+    for t in times
+)
 
 # 애니메이션 재생/일시정지 버튼 설정
+# 프레임은 scatter trace 만 갱신하므로 redraw 없이 바뀐 trace 만 다시 그립니다 (고정된 trace 와 축은 유지).
 fig.update_layout(
     updatemenus=[
         dict(
@@ -193,7 +177,7 @@ fig.update_layout(
             buttons=[
                 dict(label="▶ Play",
                      method="animate",
-                     args=[None, {"frame": {"duration": 50, "redraw": True}, "fromcurrent": True}]),
+                     args=[None, {"frame": {"duration": 50, "redraw": False}, "fromcurrent": True, "transition": {"duration": 0}}]),
                 dict(label="⏸ Pause",
                      method="animate",
                      args=[[None], {"frame": {"duration": 0, "redraw": False}, "mode": "immediate", "transition": {"duration": 0}}])
@@ -203,6 +187,11 @@ fig.update_layout(
 )
 
 # 타임라인 슬라이더 설정
+# 긴 시뮬레이션에서는 슬라이더 단계를 약 50개로 줄입니다 (애니메이션 프레임 해상도는 그대로 유지).
+stride = max(1, orbital_period // 50) if orbital_period > 100 else 1
+slider_times = times[::stride]
+if slider_times[-1] != times[-1]:
+    slider_times = np.append(slider_times, times[-1]) # 마지막 프레임까지 이동할 수 있도록 항상 포함
 sliders = [
     dict(
         steps=[
@@ -210,10 +199,10 @@ sliders = [
                 method="animate",
                 args=[
                     [f"frame_{t}"],
-                    {"mode": "immediate", "frame": {"duration": 50, "redraw": True}, "transition": {"duration": 0}}
+                    {"mode": "immediate", "frame": {"duration": 50, "redraw": False}, "transition": {"duration": 0}}
                 ],
                 label=str(t)
-            ) for t in times
+            ) for t in slider_times
         ],
         transition={"duration": 0},
         x=0.08,